@@ -1,14 +1,14 @@
 import streamlit as st
 import docx
-from icalendar import Calendar, Event
-from datetime import datetime, timedelta, date
+from docx.opc.exceptions import PackageNotFoundError
+from datetime import datetime, timedelta, date, timezone
 import re
-import os
+import functools
+from collections import defaultdict
 import io
-import tempfile
 import platform
-import shutil
-import base64
+import zipfile
+from lxml import etree
 
 st.set_page_config(
     page_title="Employee Shift Calendar Generator",
@@ -16,68 +16,146 @@ st.set_page_config(
     layout="wide"
 )
 
-def read_docx_tables(uploaded_file):
-    """Read all tables content from an uploaded DOCX file."""
+# WordprocessingML namespace and precompiled XPath queries used to read table text
+# straight from the document XML without building python-docx cell/paragraph objects
+W_NS = {'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'}
+_W = '{%s}' % W_NS['w']
+_TABLES_XPATH = etree.XPath('./w:tbl', namespaces=W_NS)
+_ROWS_XPATH = etree.XPath('./w:tr', namespaces=W_NS)
+_CELLS_XPATH = etree.XPath('./w:tc', namespaces=W_NS)
+_PARAGRAPHS_XPATH = etree.XPath('./w:p', namespaces=W_NS)
+# Run content python-docx turns into text: only runs directly in the paragraph or in a hyperlink
+_RUN_CONTENT_XPATH = etree.XPath(
+    '(./w:r | ./w:hyperlink/w:r)/*[self::w:t or self::w:tab or self::w:ptab'
+    ' or self::w:br or self::w:cr or self::w:noBreakHyphen]',
+    namespaces=W_NS
+)
+# Text equivalents of the empty run elements (same mapping as python-docx)
+_RUN_CONTENT_TEXT = {_W + 'tab': "\t", _W + 'ptab': "\t", _W + 'cr': "\n", _W + 'noBreakHyphen': "-"}
+_GRID_SPAN_XPATH = etree.XPath('string(./w:tcPr/w:gridSpan/@w:val)', namespaces=W_NS)
+_VMERGE_XPATH = etree.XPath('./w:tcPr/w:vMerge', namespaces=W_NS)
+
+CALENDAR_PRODID = '-//Employee Shift Calendar//example.com//'
+# Characters that must be escaped in iCalendar TEXT values (RFC 5545, section 3.3.11)
+ICAL_TEXT_ESCAPES = str.maketrans({'\\': '\\\\', ';': '\\;', ',': '\\,', '\n': '\\n', '\r': ''})
+
+# Calendars smaller than this (in bytes) are not worth deflating in the All Employees zip
+ZIP_STORE_THRESHOLD = 4096
+
+# Greek month names as they appear in schedule file names, e.g. "ΕΦΗΜΕΡΙΕΣ ΜΑΡΤΙΟΣ 2025.docx"
+FILENAME_MONTHS = {
+    "ΙΑΝΟΥΑΡΙΟΣ": 1, "ΦΕΒΡΟΥΑΡΙΟΣ": 2, "ΜΑΡΤΙΟΣ": 3, "ΑΠΡΙΛΙΟΣ": 4,
+    "ΜΑΙΟΣ": 5, "ΙΟΥΝΙΟΣ": 6, "ΙΟΥΛΙΟΣ": 7, "ΑΥΓΟΥΣΤΟΣ": 8,
+    "ΣΕΠΤΕΜΒΡΙΟΣ": 9, "ΟΚΤΩΒΡΙΟΣ": 10, "ΝΟΕΜΒΡΙΟΣ": 11, "ΔΕΚΕΜΒΡΙΟΣ": 12
+}
+# Greek month names (genitive and nominative) that may appear in the month column of the schedule tables
+GREEK_MONTHS = {
+    "ΙΑΝΟΥΑΡΙΟΥ": 1, "ΦΕΒΡΟΥΑΡΙΟΥ": 2, "ΜΑΡΤΙΟΥ": 3, "ΑΠΡΙΛΙΟΥ": 4,
+    "ΜΑΙΟΥ": 5, "ΙΟΥΝΙΟΥ": 6, "ΙΟΥΛΙΟΥ": 7, "ΑΥΓΟΥΣΤΟΥ": 8,
+    "ΣΕΠΤΕΜΒΡΙΟΥ": 9, "ΟΚΤΩΒΡΙΟΥ": 10, "ΝΟΕΜΒΡΙΟΥ": 11, "ΔΕΚΕΜΒΡΙΟΥ": 12,
+    **FILENAME_MONTHS
+}
+# Minimum number of columns of the first (Regular/On-Call) and second (Μεγάλη/Μικρή/ΤΕΠ) table formats
+FIRST_TABLE_COLUMNS = 4
+SECOND_TABLE_COLUMNS = 6
+# Column index and shift type of each employee column in the second table
+SECOND_TABLE_SHIFTS = (
+    (3, "Μεγάλη Shift (24h)"),
+    (4, "Μικρή Shift (24h)"),
+    (5, "TEP Shift (12h)")
+)
+_YEAR_RE = re.compile(r'20\d\d')
+# Single-pass matchers for the month names (longest names first so no name shadows a longer one)
+_FILENAME_MONTH_RE = re.compile('|'.join(map(re.escape, sorted(FILENAME_MONTHS, key=len, reverse=True))))
+_GREEK_MONTH_RE = re.compile('|'.join(map(re.escape, sorted(GREEK_MONTHS, key=len, reverse=True))))
+
+def cell_text(tc):
+    """Return the text of a <w:tc> element, one line per paragraph (same as python-docx cell.text)."""
+    paragraphs = []
+    for p in _PARAGRAPHS_XPATH(tc):
+        parts = []
+        for node in _RUN_CONTENT_XPATH(p):
+            tag = node.tag
+            if tag == _W + 't':
+                parts.append(node.text or "")
+            elif tag == _W + 'br':
+                # Line breaks (page/column breaks carry no text)
+                if node.get(_W + 'type') in (None, 'textWrapping'):
+                    parts.append("\n")
+            else:
+                parts.append(_RUN_CONTENT_TEXT[tag])
+        paragraphs.append("".join(parts))
+    return "\n".join(paragraphs)
+
+def table_rows(tbl):
+    """Extract the text of every row of a <w:tbl> element as a list of cell strings."""
+    rows = []
+    row_above = []
+    for tr in _ROWS_XPATH(tbl):
+        row_data = []
+        for tc in _CELLS_XPATH(tr):
+            span = int(_GRID_SPAN_XPATH(tc) or 1)
+            vmerge = _VMERGE_XPATH(tc)
+            if vmerge and vmerge[0].get(_W + 'val', 'continue') == 'continue' and len(row_above) > len(row_data):
+                # Vertically merged cell: repeat the text of the cell above
+                text = row_above[len(row_data)]
+            else:
+                text = cell_text(tc).strip()
+            # Horizontally merged cells occupy one entry per spanned grid column
+            row_data.extend([text] * span)
+        row_above = row_data
+        rows.append(row_data)
+    return rows
+
+@st.cache_data(show_spinner=False)
+def read_docx_tables(file_bytes):
+    """Read all tables content from the bytes of a DOCX file (cached per file content)."""
     try:
-        # Save the uploaded file to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_file_path = tmp_file.name
-        
-        doc = docx.Document(tmp_file_path)
-        
-        # Clean up temporary file
-        os.unlink(tmp_file_path)
+        # python-docx reads file-like objects, so open the uploaded bytes in memory
+        try:
+            doc = docx.Document(io.BytesIO(file_bytes))
+        except (PackageNotFoundError, zipfile.BadZipFile):
+            st.error("The uploaded file is not a valid .docx document.")
+            return []
         
-        if not doc.tables:
+        tables = _TABLES_XPATH(doc.element.body)
+        if not tables:
             st.warning("No tables found in the document.")
             return []
         
         tables_data = []
         
-        for table_index, table in enumerate(doc.tables):
-            rows = []
-            for row in table.rows:
-                row_data = [cell.text.strip() for cell in row.cells]
-                # Skip empty rows
-                if any(row_data):
-                    rows.append(row_data)
-            
+        for tbl in tables:
+            # Skip rows with an empty first (day/date) cell; the parsers ignore them anyway
+            rows = [row_data for row_data in table_rows(tbl) if row_data and row_data[0]]
             tables_data.append(rows)
-            st.write(f"Table {table_index+1}: Found {len(rows)} rows with data")
         
         return tables_data
     except Exception as e:
         st.error(f"Error reading document: {e}")
         return []
 
-def parse_first_table(rows, month, year):
-    """Parse the first table format (Regular and On-Call shifts) with month rollover detection."""
-    shifts = []
-    current_month = month
-    current_year = year
+def show_tables_summary(tables):
+    """Display how many rows with data were found in each table."""
+    for table_index, rows in enumerate(tables):
+        st.write(f"Table {table_index+1}: Found {len(rows)} rows with data")
+
+def clean_name(cell, marker):
+    """Remove a marker character ('*' or '>') and surrounding whitespace from an employee name."""
+    return cell.replace(marker, "").strip()
+
+def iter_schedule_days(rows, month, year, table_name):
+    """Yield (shift_date, day_of_week, row) for each day row of a schedule table with month rollover detection."""
+    # Months counted from year 0, so moving to the next month carries into the year by itself
+    month_index = year * 12 + month - 1
     last_day = 0  # Track the last day number we've seen
     
-    # Dictionary of Greek month names to month numbers
-    greek_months = {
-        "ΙΑΝΟΥΑΡΙΟΥ": 1, "ΦΕΒΡΟΥΑΡΙΟΥ": 2, "ΜΑΡΤΙΟΥ": 3, "ΑΠΡΙΛΙΟΥ": 4,
-        "ΜΑΙΟΥ": 5, "ΙΟΥΝΙΟΥ": 6, "ΙΟΥΛΙΟΥ": 7, "ΑΥΓΟΥΣΤΟΥ": 8,
-        "ΣΕΠΤΕΜΒΡΙΟΥ": 9, "ΟΚΤΩΒΡΙΟΥ": 10, "ΝΟΕΜΒΡΙΟΥ": 11, "ΔΕΚΕΜΒΡΙΟΥ": 12,
-        "ΙΑΝΟΥΑΡΙΟΣ": 1, "ΦΕΒΡΟΥΑΡΙΟΣ": 2, "ΜΑΡΤΙΟΣ": 3, "ΑΠΡΙΛΙΟΣ": 4,
-        "ΜΑΙΟΣ": 5, "ΙΟΥΝΙΟΣ": 6, "ΙΟΥΛΙΟΣ": 7, "ΑΥΓΟΥΣΤΟΣ": 8,
-        "ΣΕΠΤΕΜΒΡΙΟΣ": 9, "ΟΚΤΩΒΡΙΟΣ": 10, "ΝΟΕΜΒΡΙΟΣ": 11, "ΔΕΚΕΜΒΡΙΟΣ": 12
-    }
-    
     for row in rows:
-        if len(row) < 4:  # Ensure row has enough columns
-            continue
-        
         try:
-            # Extract day, month_text, day_of_week, and employees
+            # Extract day, month_text and day_of_week
             day = row[0].strip()
-            month_text = row[1].strip() if len(row) > 1 else ""
-            day_of_week = row[2].strip() if len(row) > 2 else ""
-            employees_cell = row[3].strip() if len(row) > 3 else ""
+            month_text = row[1].strip()
+            day_of_week = row[2].strip()
             
             # Skip header rows or rows without day number
             if not day or not day[0].isdigit():
@@ -91,161 +169,103 @@ def parse_first_table(rows, month, year):
             day = int(day)
             
             # Check for explicit month name in the month_text field
-            found_month = None
-            for greek_month, month_num in greek_months.items():
-                if greek_month in month_text:
-                    found_month = month_num
-                    break
+            month_match = _GREEK_MONTH_RE.search(month_text)
+            found_month = GREEK_MONTHS[month_match.group()] if month_match else None
             
             if found_month is not None:
                 # Use explicitly mentioned month
-                current_month = found_month
                 # If the new month is less than the original month, we've moved to next year
-                if current_month < month and month > 10 and current_month < 3:
-                    current_year += 1
-                st.info(f"Explicit month found: now processing {current_month}/{current_year}")
+                found_year = year + 1 if found_month < month and month > 10 and found_month < 3 else year
+                month_index = found_year * 12 + found_month - 1
+                st.info(f"Explicit month found: now processing {found_month}/{found_year}")
             elif day < last_day and last_day > 20 and day < 10:
                 # Move to next month based on day number patterns
-                current_month += 1
-                if current_month > 12:
-                    current_month = 1
-                    current_year += 1
-                st.info(f"Month rollover detected: now processing {current_month}/{current_year}")
+                month_index += 1
+                st.info(f"Month rollover detected: now processing {month_index % 12 + 1}/{month_index // 12}")
             
             last_day = day
             
-            # Parse employee names (may contain two employees, one with asterisk)
-            employees = employees_cell.split('\n')
-            employees = [e.strip() for e in employees if e.strip()]
+            # Create shift date from the current month index
+            shift_date = date(month_index // 12, month_index % 12 + 1, day)
+        except Exception as e:
+            st.error(f"Error parsing row in {table_name} {row}: {e}")
+            continue
+        
+        yield shift_date, day_of_week, row
+
+def parse_first_table(rows, month, year):
+    """Parse the first table format (Regular and On-Call shifts) with month rollover detection."""
+    shifts = []
+    # Keep only rows with enough columns
+    rows = [row for row in rows if len(row) >= FIRST_TABLE_COLUMNS]
+    
+    for shift_date, day_of_week, row in iter_schedule_days(rows, month, year, "first table"):
+        # Parse employee names (may contain two employees, one with asterisk)
+        for employee in row[3].split('\n'):
+            employee_name = clean_name(employee, "*")
+            if not employee_name:
+                continue
+            
+            is_on_call = "*" in employee
+            shift_type = "On-Call Shift" if is_on_call else "Regular Shift"
             
-            for employee in employees:
-                is_on_call = "*" in employee
-                employee_name = employee.replace("*", "").strip()
-                
-                # Create shift date using current_month and current_year
-                shift_date = date(current_year, current_month, day)
-                
-                shift_type = "On-Call Shift" if is_on_call else "Regular Shift"
-                
+            shifts.append({
+                'employee': employee_name,
+                'employee_key': employee_name.casefold(),
+                'date': shift_date,
+                'day_of_week': day_of_week,
+                'shift_type': shift_type
+            })
+    
+    return shifts
+
+def parse_second_table(rows, month, year):
+    """Parse the second table format (Μεγάλη, Μικρή, ΤΕΠ shifts) with month rollover detection."""
+    shifts = []
+    # Keep only rows with enough columns for the second table format
+    rows = [row for row in rows if len(row) >= SECOND_TABLE_COLUMNS]
+    
+    for shift_date, day_of_week, row in iter_schedule_days(rows, month, year, "second table"):
+        # Process the Μεγάλη, Μικρή and ΤΕΠ shift columns
+        for column, shift_type in SECOND_TABLE_SHIFTS:
+            employee_name = clean_name(row[column], ">")
+            if employee_name:
                 shifts.append({
                     'employee': employee_name,
+                    'employee_key': employee_name.casefold(),
                     'date': shift_date,
                     'day_of_week': day_of_week,
                     'shift_type': shift_type
                 })
-        except Exception as e:
-            st.error(f"Error parsing row in first table {row}: {e}")
-            continue
     
     return shifts
-
-def parse_second_table(rows, month, year):
-    """Parse the second table format (Μεγάλη, Μικρή, ΤΕΠ shifts) with month rollover detection."""
-    shifts = []
-    current_month = month
-    current_year = year
-    last_day = 0  # Track the last day number we've seen
     
-    # Dictionary of Greek month names to month numbers
-    greek_months = {
-        "ΙΑΝΟΥΑΡΙΟΥ": 1, "ΦΕΒΡΟΥΑΡΙΟΥ": 2, "ΜΑΡΤΙΟΥ": 3, "ΑΠΡΙΛΙΟΥ": 4,
-        "ΜΑΙΟΥ": 5, "ΙΟΥΝΙΟΥ": 6, "ΙΟΥΛΙΟΥ": 7, "ΑΥΓΟΥΣΤΟΥ": 8,
-        "ΣΕΠΤΕΜΒΡΙΟΥ": 9, "ΟΚΤΩΒΡΙΟΥ": 10, "ΝΟΕΜΒΡΙΟΥ": 11, "ΔΕΚΕΜΒΡΙΟΥ": 12,
-        "ΙΑΝΟΥΑΡΙΟΣ": 1, "ΦΕΒΡΟΥΑΡΙΟΣ": 2, "ΜΑΡΤΙΟΣ": 3, "ΑΠΡΙΛΙΟΣ": 4,
-        "ΜΑΙΟΣ": 5, "ΙΟΥΝΙΟΣ": 6, "ΙΟΥΛΙΟΣ": 7, "ΑΥΓΟΥΣΤΟΣ": 8,
-        "ΣΕΠΤΕΜΒΡΙΟΣ": 9, "ΟΚΤΩΒΡΙΟΣ": 10, "ΝΟΕΜΒΡΙΟΣ": 11, "ΔΕΚΕΜΒΡΙΟΣ": 12
-    }
+def select_table_parser(rows):
+    """Pick the parser for a table from its shape: the second table format has at least six columns."""
+    wide_rows = sum(1 for row in rows if len(row) >= SECOND_TABLE_COLUMNS)
+    if wide_rows * 2 > len(rows):
+        return parse_second_table
+    return parse_first_table
+
+def parse_dmy(date_str):
+    """Split a DD-MM-YYYY or DD/MM/YYYY string into (day, month, year) ints, or return None."""
+    if not 8 <= len(date_str) <= 10:
+        return None
     
-    for row in rows:
-        if len(row) < 6:  # Ensure row has enough columns for second table format
-            continue
-        
-        try:
-            # Extract day, month_text, day_of_week, and employees from different shifts
-            day = row[0].strip()
-            month_text = row[1].strip() if len(row) > 1 else ""
-            day_of_week = row[2].strip() if len(row) > 2 else ""
-            megali_shift = row[3].strip() if len(row) > 3 else ""
-            mikri_shift = row[4].strip() if len(row) > 4 else ""
-            tep_shift = row[5].strip() if len(row) > 5 else ""
-            
-            # Skip header rows or rows without day number
-            if not day or not day[0].isdigit():
-                continue
-            
-            # Handle special formatting like "*01**" for May 1st
-            day = day.strip("*").strip()
-            if not day.isdigit():
-                continue
-                
-            day = int(day)
-            
-            # Check for explicit month name in the month_text field
-            found_month = None
-            for greek_month, month_num in greek_months.items():
-                if greek_month in month_text:
-                    found_month = month_num
-                    break
-            
-            if found_month is not None:
-                # Use explicitly mentioned month
-                current_month = found_month
-                # If the new month is less than the original month, we've moved to next year
-                if current_month < month and month > 10 and current_month < 3:
-                    current_year += 1
-                st.info(f"Explicit month found: now processing {current_month}/{current_year}")
-            elif day < last_day and last_day > 20 and day < 10:
-                # Move to next month based on day number patterns
-                current_month += 1
-                if current_month > 12:
-                    current_month = 1
-                    current_year += 1
-                st.info(f"Month rollover detected: now processing {current_month}/{current_year}")
-            
-            last_day = day
-            
-            # Use current_month and current_year for the shift date
-            shift_date = date(current_year, current_month, day)
-            
-            # Process Μεγάλη shift (24h)
-            if megali_shift:
-                employee_name = megali_shift.replace(">", "").strip()
-                if employee_name:
-                    shifts.append({
-                        'employee': employee_name,
-                        'date': shift_date,
-                        'day_of_week': day_of_week,
-                        'shift_type': "Μεγάλη Shift (24h)"
-                    })
-            
-            # Process Μικρή shift (24h)
-            if mikri_shift:
-                employee_name = mikri_shift.replace(">", "").strip()
-                if employee_name:
-                    shifts.append({
-                        'employee': employee_name,
-                        'date': shift_date,
-                        'day_of_week': day_of_week,
-                        'shift_type': "Μικρή Shift (24h)"
-                    })
-            
-            # Process ΤΕΠ shift (12h)
-            if tep_shift:
-                employee_name = tep_shift.replace(">", "").strip()
-                if employee_name:
-                    shifts.append({
-                        'employee': employee_name,
-                        'date': shift_date,
-                        'day_of_week': day_of_week,
-                        'shift_type': "TEP Shift (12h)"
-                    })
-                
-        except Exception as e:
-            st.error(f"Error parsing row in second table {row}: {e}")
-            continue
+    # Day and month have one or two digits, the year always has four
+    first_sep = 1 if date_str[1] in "-/" else 2
+    second_sep = len(date_str) - 5
+    if date_str[first_sep] not in "-/" or date_str[second_sep] not in "-/":
+        return None
     
-    return shifts
+    day = date_str[:first_sep]
+    month = date_str[first_sep + 1:second_sep]
+    year = date_str[second_sep + 1:]
+    if not (day.isdecimal() and month.isdecimal() and year.isdecimal()) or len(month) > 2:
+        return None
     
+    return int(day), int(month), int(year)
+
 def parse_specialty_on_call_table(rows):
     """Parse the specialty on-call table format with date (DD-MM-YYYY or DD/MM/YYYY) in first column."""
     shifts = []
@@ -261,23 +281,17 @@ def parse_specialty_on_call_table(rows):
             employee_name = row[2].strip() if len(row) > 2 else ""
             
             # Skip header rows or rows without proper date format
-            # Updated regex to match both DD-MM-YYYY and DD/MM/YYYY formats
-            if not re.match(r"\d{1,2}[-/]\d{1,2}[-/]\d{4}", date_str):
+            parsed_date = parse_dmy(date_str)
+            if parsed_date is None:
                 continue
             
-            # Parse date (supports both DD-MM-YYYY and DD/MM/YYYY)
-            if '-' in date_str:
-                day, month, year = map(int, date_str.split('-'))
-            elif '/' in date_str:
-                day, month, year = map(int, date_str.split('/'))
-            else:
-                continue  # Skip if date format doesn't match either pattern
-                
+            day, month, year = parsed_date
             shift_date = date(year, month, day)
             
             if employee_name:
                 shifts.append({
                     'employee': employee_name,
+                    'employee_key': employee_name.casefold(),
                     'date': shift_date,
                     'day_of_week': day_of_week,
                     'shift_type': "On-Call Specialty",  # Will be updated when adding to all_shifts
@@ -289,181 +303,240 @@ def parse_specialty_on_call_table(rows):
     
     return shifts
 
-def create_calendar_for_employee(shifts, employee_name, cath_lab_shifts=None, ep_shifts=None):
-    """Create an iCalendar file with all-day events for a specific employee."""
-    # Filter shifts for this specific employee
-    employee_shifts = [s for s in shifts if s['employee'].lower() == employee_name.lower()]
-    
-    # Also check if the employee has any cath lab or EP shifts
-    employee_cath_lab_shifts = []
-    employee_ep_shifts = []
-    
-    if cath_lab_shifts:
-        employee_cath_lab_shifts = [s for s in cath_lab_shifts if s['employee'].lower() == employee_name.lower()]
-        
-    if ep_shifts:
-        employee_ep_shifts = [s for s in ep_shifts if s['employee'].lower() == employee_name.lower()]
+def escape_ical_text(value):
+    """Escape a TEXT property value as required by RFC 5545."""
+    return value.translate(ICAL_TEXT_ESCAPES)
+
+def fold_ical_line(line):
+    """Encode a content line as UTF-8, folded into lines of at most 75 octets and terminated by CRLF."""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return data + b"\r\n"
     
-    if not employee_shifts and not employee_cath_lab_shifts and not employee_ep_shifts:
-        st.warning(f"No shifts found for employee: {employee_name}")
-        return None
+    chunks = []
+    start = 0
+    limit = 75
+    while len(data) - start > limit:
+        end = start + limit
+        # Never split a multi-byte UTF-8 character
+        while data[end] & 0xC0 == 0x80:
+            end -= 1
+        chunks.append(data[start:end])
+        start = end
+        limit = 74  # Continuation lines start with a space
+    chunks.append(data[start:])
+    return b"\r\n ".join(chunks) + b"\r\n"
+
+def emit_vevent(uid, dtstart, dtend, summary, description, dtstamp):
+    """Return the content lines of an all-day VEVENT (dtstamp is already formatted as UTC)."""
+    return [
+        "BEGIN:VEVENT",
+        f"SUMMARY:{escape_ical_text(summary)}",
+        # All-day events need a DATE value type
+        f"DTSTART;VALUE=DATE:{dtstart.strftime('%Y%m%d')}",
+        f"DTEND;VALUE=DATE:{dtend.strftime('%Y%m%d')}",
+        f"DTSTAMP:{dtstamp}",
+        f"UID:{escape_ical_text(uid)}",
+        f"DESCRIPTION:{escape_ical_text(description)}",
+        "END:VEVENT"
+    ]
+
+def index_shifts_by_date(shifts):
+    """Group a list of shifts into a dict mapping each date to the shifts on that date."""
+    by_date = defaultdict(list)
+    for shift in shifts or ():
+        by_date[shift['date']].append(shift)
+    return by_date
+
+def index_coworkers_by_date(shifts):
+    """Map each date to its (employee key, "- Name: Shift") coworker lines, sorted once."""
+    coworkers_by_date = {}
+    for shift_date, date_shifts in index_shifts_by_date(shifts).items():
+        lines = sorted((f"{s['employee']}: {s['shift_type']}", s['employee_key']) for s in date_shifts)
+        coworkers_by_date[shift_date] = [(employee, f"- {line}") for line, employee in lines]
+    return coworkers_by_date
+
+def build_calendar(employee_name, employee_shifts, coworkers_by_date, cath_by_date, ep_by_date, dtstamp):
+    """Build the iCalendar data for one employee from their shifts and the date-indexed schedules."""
+    employee_key = employee_name.casefold()
     
-    cal = Calendar()
-    cal.add('prodid', '-//Employee Shift Calendar//example.com//')
-    cal.add('version', '2.0')
-    cal.add('calscale', 'GREGORIAN')
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{escape_ical_text(CALENDAR_PRODID)}", "CALSCALE:GREGORIAN"]
+    dtstamp = dtstamp.strftime('%Y%m%dT%H%M%SZ')
     
     # Group shifts by date to combine multiple shifts on the same day
-    shifts_by_date = {}
-    
-    # Add regular shifts to the grouping
-    for shift in employee_shifts:
-        date_key = shift['date'].isoformat()
-        if date_key not in shifts_by_date:
-            shifts_by_date[date_key] = []
-        shifts_by_date[date_key].append(shift)
-    
-    # Add cath lab shifts if they don't overlap with existing dates
-    for shift in employee_cath_lab_shifts:
-        date_key = shift['date'].isoformat()
-        if date_key not in shifts_by_date:
-            shifts_by_date[date_key] = []
-        shifts_by_date[date_key].append(shift)
-    
-    # Add EP shifts if they don't overlap with existing dates
-    for shift in employee_ep_shifts:
-        date_key = shift['date'].isoformat()
-        if date_key not in shifts_by_date:
-            shifts_by_date[date_key] = []
-        shifts_by_date[date_key].append(shift)
+    # (regular shifts first, then cath lab and EP shifts)
+    shifts_by_date = index_shifts_by_date(employee_shifts)
     
     # Create events for each date, combining shift information
-    for date_key, date_shifts in shifts_by_date.items():
-        event = Event()
-        
+    for shift_date, date_shifts in shifts_by_date.items():
         # Combine all shift types for the summary
         shift_types = [s['shift_type'] for s in date_shifts]
         day_of_week = date_shifts[0]['day_of_week']  # They all have the same date
-        shift_date = date_shifts[0]['date']
         
         # Format the summary to show all shift types
         summary = f"{', '.join(shift_types)} - {day_of_week}"
-        event.add('summary', summary)
-        
-        # All-day events need a DATE value type
-        event.add('dtstart', shift_date)
         
         # For all-day events, the end date should be the next day
         # The end date is non-inclusive in the iCalendar spec
         end_date = shift_date + timedelta(days=1)
-        event.add('dtend', end_date)
-        
-        event.add('dtstamp', datetime.now())
         
         # Generate a unique ID for the event
         uid = f"{employee_name.replace(' ', '')}-{shift_date.strftime('%Y%m%d')}@shifts.example.com"
-        event.add('uid', uid)
         
         # Add description with details about all employees working that day
         description_parts = [f"Your shifts: {', '.join(shift_types)}"]
         
-        # Find all employees working on this date
-        coworkers_info = []
-        for s in shifts:
-            # If it's the same date but not the current employee
-            if s['date'] == shift_date and s['employee'].lower() != employee_name.lower():
-                coworkers_info.append(f"{s['employee']}: {s['shift_type']}")
+        # Find all other employees working on this date (already sorted)
+        coworkers_info = [
+            line for coworker, line in coworkers_by_date.get(shift_date, ())
+            if coworker != employee_key
+        ]
         
         # Add coworkers section if any exist
         if coworkers_info:
             description_parts.append("\nCoworkers on this day:")
-            for info in sorted(coworkers_info):
-                description_parts.append(f"- {info}")
+            description_parts.extend(coworkers_info)
         else:
             description_parts.append("\nNo other employees scheduled on this day.")
         
         # Add Cath Lab on-call information if available
-        if cath_lab_shifts:
-            cath_lab_employee = None
-            for shift in cath_lab_shifts:
-                if shift['date'] == shift_date and shift['employee'].lower() != employee_name.lower():
-                    cath_lab_employee = shift['employee']
-                    break
+        if cath_by_date:
+            cath_lab_employee = next(
+                (shift['employee'] for shift in cath_by_date.get(shift_date, ())
+                 if shift['employee_key'] != employee_key),
+                None
+            )
             
             if cath_lab_employee:
                 description_parts.append(f"\nCath Lab On-Call: {cath_lab_employee}")
         
         # Add Electrophysiology on-call information if available
-        if ep_shifts:
-            ep_employee = None
-            for shift in ep_shifts:
-                if shift['date'] == shift_date and shift['employee'].lower() != employee_name.lower():
-                    ep_employee = shift['employee']
-                    break
+        if ep_by_date:
+            ep_employee = next(
+                (shift['employee'] for shift in ep_by_date.get(shift_date, ())
+                 if shift['employee_key'] != employee_key),
+                None
+            )
             
             if ep_employee:
                 description_parts.append(f"\nElectrophysiology On-Call: {ep_employee}")
         
-        event.add('description', "\n".join(description_parts))
-        
-        cal.add_component(event)
+        lines.extend(emit_vevent(uid, shift_date, end_date, summary, "\n".join(description_parts), dtstamp))
+    
+    lines.append("END:VCALENDAR")
     
     # Return the calendar data
-    return cal.to_ical()
+    return b"".join(fold_ical_line(line) for line in lines)
 
-def extract_month_year_from_filename(filename):
-    """Attempt to extract month and year from the filename."""
-    # Example: "ΕΦΗΜΕΡΙΕΣ ΜΑΡΤΙΟΣ 2025.docx"
-    month_dict = {
-        "ΙΑΝΟΥΑΡΙΟΣ": 1, "ΦΕΒΡΟΥΑΡΙΟΣ": 2, "ΜΑΡΤΙΟΣ": 3, "ΑΠΡΙΛΙΟΣ": 4,
-        "ΜΑΙΟΣ": 5, "ΙΟΥΝΙΟΣ": 6, "ΙΟΥΛΙΟΣ": 7, "ΑΥΓΟΥΣΤΟΣ": 8,
-        "ΣΕΠΤΕΜΒΡΙΟΣ": 9, "ΟΚΤΩΒΡΙΟΣ": 10, "ΝΟΕΜΒΡΙΟΣ": 11, "ΔΕΚΕΜΒΡΙΟΣ": 12
-    }
+def create_calendar_for_employee(shifts, employee_name, cath_lab_shifts=None, ep_shifts=None):
+    """Create an iCalendar file with all-day events for a specific employee."""
+    employee_key = employee_name.casefold()
     
-    # Also look for month name in the document content
-    month_from_content = None
-    if "ΜΑΡΤΙΟΣ" in filename:
-        month_from_content = 3
+    # Filter shifts for this specific employee
+    employee_shifts = [s for s in shifts if s['employee_key'] == employee_key]
     
-    # Default to current month and year if extraction fails
-    default_month = datetime.now().month
-    default_year = datetime.now().year
+    # Also check if the employee has any cath lab or EP shifts
+    employee_cath_lab_shifts = []
+    employee_ep_shifts = []
     
-    try:
-        # Try to extract month name and year
-        for month_name, month_num in month_dict.items():
-            if month_name in filename:
-                # Found month, now look for year
-                year_match = re.search(r'20\d\d', filename)
-                if year_match:
-                    year = int(year_match.group())
-                    return month_num, year
-                return month_num, default_year
+    if cath_lab_shifts:
+        employee_cath_lab_shifts = [s for s in cath_lab_shifts if s['employee_key'] == employee_key]
         
-        # If we found month in content, use that
-        if month_from_content:
-            year_match = re.search(r'20\d\d', filename)
-            if year_match:
-                year = int(year_match.group())
-                return month_from_content, year
-            return month_from_content, default_year
-            
-    except:
-        pass
+    if ep_shifts:
+        employee_ep_shifts = [s for s in ep_shifts if s['employee_key'] == employee_key]
+    
+    if not employee_shifts and not employee_cath_lab_shifts and not employee_ep_shifts:
+        st.warning(f"No shifts found for employee: {employee_name}")
+        return None
     
-    return default_month, default_year
+    # Index all shifts by date once so each event can look up its coworkers directly
+    return build_calendar(
+        employee_name,
+        employee_shifts + employee_cath_lab_shifts + employee_ep_shifts,
+        index_coworkers_by_date(shifts),
+        index_shifts_by_date(cath_lab_shifts),
+        index_shifts_by_date(ep_shifts),
+        datetime.now(timezone.utc)
+    )
 
-def download_button(object_to_download, download_filename, button_text):
-    """
-    Generates a link to download the given object.
+def create_all_calendars(shifts, cath_lab_shifts=None, ep_shifts=None):
+    """Create a zip archive containing an iCalendar file for every employee in the schedule.
+    
+    Returns the zip data and the number of calendar files written to it.
     """
-    if isinstance(object_to_download, bytes):
-        b64 = base64.b64encode(object_to_download).decode()
-    else:
-        b64 = base64.b64encode(object_to_download.encode()).decode()
+    # The date indexes are built once and shared by every employee's calendar
+    coworkers_by_date = index_coworkers_by_date(shifts)
+    cath_by_date = index_shifts_by_date(cath_lab_shifts)
+    ep_by_date = index_shifts_by_date(ep_shifts)
+    # All calendars in the archive share the same creation timestamp
+    dtstamp = datetime.now(timezone.utc)
+    
+    # Partition the shifts by employee in a single pass over each list
+    employee_names = {}
+    shifts_by_employee = defaultdict(list)
+    for shift in shifts:
+        key = shift['employee_key']
+        employee_names.setdefault(key, shift['employee'])
+        shifts_by_employee[key].append(shift)
+    
+    # Specialty on-call shifts are added for employees that appear in the main schedule
+    for specialty_shifts in (cath_lab_shifts, ep_shifts):
+        for shift in specialty_shifts or ():
+            key = shift['employee_key']
+            if key in shifts_by_employee:
+                shifts_by_employee[key].append(shift)
+    
+    buffer = io.BytesIO()
+    used_file_names = set()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zip_file:
+        for key, employee_shifts in shifts_by_employee.items():
+            employee_name = employee_names[key]
+            
+            # Names like "Α Β" and "Α_Β" map to the same file name; number the later ones
+            # (compared case-insensitively so they also stay distinct when extracted)
+            base_name = f"{employee_name.replace(' ', '_')}_shifts"
+            file_name = f"{base_name}.ics"
+            suffix = 2
+            while file_name.casefold() in used_file_names:
+                file_name = f"{base_name}_{suffix}.ics"
+                suffix += 1
+            used_file_names.add(file_name.casefold())
+            
+            calendar_data = build_calendar(employee_name, employee_shifts, coworkers_by_date, cath_by_date, ep_by_date, dtstamp)
+            # Write each calendar as soon as it is built; small files are stored without compression
+            compress_type = zipfile.ZIP_STORED if len(calendar_data) < ZIP_STORE_THRESHOLD else zipfile.ZIP_DEFLATED
+            zip_file.writestr(file_name, calendar_data, compress_type=compress_type)
+    
+    return buffer.getvalue(), len(used_file_names)
+
+@functools.lru_cache(maxsize=32)
+def parse_filename_month_year(filename):
+    """Return the (month, year) named in the filename; either is None if not found."""
+    # Example: "ΕΦΗΜΕΡΙΕΣ ΜΑΡΤΙΟΣ 2025.docx"
+    # Try to extract month name and year in a single scan of the upper-cased name
+    filename = filename.upper()
+    month_match = _FILENAME_MONTH_RE.search(filename)
+    year_match = _YEAR_RE.search(filename)
+    return (
+        FILENAME_MONTHS[month_match.group()] if month_match else None,
+        int(year_match.group()) if year_match else None
+    )
 
-    dl_link = f'<a href="data:file/txt;base64,{b64}" download="{download_filename}">{button_text}</a>'
-    return dl_link
+def extract_month_year_from_filename(filename):
+    """Attempt to extract month and year from the filename."""
+    # Default to current month and year if extraction fails
+    # (kept outside the cached parsing so the defaults never go stale)
+    now = datetime.now()
+    
+    try:
+        month_num, year = parse_filename_month_year(filename)
+        if month_num is not None:
+            # Found month, now use the year if there is one
+            return month_num, year or now.year
+    except:
+        pass
+    
+    return now.month, now.year
 
 def main():
     st.title("🏥 Employee Shift Calendar Generator")
@@ -526,25 +599,22 @@ def main():
         if st.button("Process Schedule Files"):
             with st.spinner("Processing files..."):
                 # Read and parse the main document
-                tables = read_docx_tables(main_file)
+                tables = read_docx_tables(main_file.getvalue())
+                show_tables_summary(tables)
                 
                 if not tables:
                     st.error("No tables found in the main document.")
                 else:
-                    # Parse shifts from both tables
+                    # Parse shifts from each table with the parser matching its format
                     all_shifts = []
                     
-                    # Process first table (if exists)
-                    if len(tables) >= 1:
-                        first_table_shifts = parse_first_table(tables[0], month, year)
-                        all_shifts.extend(first_table_shifts)
-                        st.write(f"Found {len(first_table_shifts)} shifts in first table")
-                    
-                    # Process second table (if exists)
-                    if len(tables) >= 2:
-                        second_table_shifts = parse_second_table(tables[1], month, year)
-                        all_shifts.extend(second_table_shifts)
-                        st.write(f"Found {len(second_table_shifts)} shifts in second table")
+                    # Only the first two tables hold the schedule; any later tables (legends,
+                    # signatures, phone lists) are ignored
+                    for table_index, table in enumerate(tables[:2]):
+                        parse_table = select_table_parser(table)
+                        table_shifts = parse_table(table, month, year)
+                        all_shifts.extend(table_shifts)
+                        st.write(f"Found {len(table_shifts)} shifts in table {table_index+1}")
                     
                     if not all_shifts:
                         st.error("No shifts found in any table!")
@@ -552,7 +622,8 @@ def main():
                         # Process Cath Lab shifts
                         cath_lab_shifts = None
                         if include_cath_lab and cath_lab_file:
-                            cath_lab_tables = read_docx_tables(cath_lab_file)
+                            cath_lab_tables = read_docx_tables(cath_lab_file.getvalue())
+                            show_tables_summary(cath_lab_tables)
                             if cath_lab_tables:
                                 cath_lab_shifts = []
                                 for table in cath_lab_tables:
@@ -565,7 +636,8 @@ def main():
                         # Process Electrophysiology shifts
                         ep_shifts = None
                         if include_ep and ep_file:
-                            ep_tables = read_docx_tables(ep_file)
+                            ep_tables = read_docx_tables(ep_file.getvalue())
+                            show_tables_summary(ep_tables)
                             if ep_tables:
                                 ep_shifts = []
                                 for table in ep_tables:
@@ -609,7 +681,16 @@ def main():
                     
                     if selected_employee == "All Employees":
                         # Create a zip file with calendars for all employees
-                        st.error("Bulk download for all employees is not implemented yet. Please select a specific employee.")
+                        zip_data, calendar_count = create_all_calendars(all_shifts, cath_lab_shifts, ep_shifts)
+                        
+                        st.download_button(
+                            label="Download Calendars for All Employees",
+                            data=zip_data,
+                            file_name="all_employees_shifts.zip",
+                            mime="application/zip"
+                        )
+                        
+                        st.success(f"Calendars for {calendar_count} employees generated successfully!")
                     else:
                         # Generate calendar for the selected employee
                         calendar_data = create_calendar_for_employee(
@@ -624,13 +705,11 @@ def main():
                             file_name = f"{selected_employee.replace(' ', '_')}_shifts.ics"
                             
                             # Display download button
-                            st.markdown(
-                                download_button(
-                                    calendar_data, 
-                                    file_name, 
-                                    f"Download Calendar for {selected_employee}"
-                                ),
-                                unsafe_allow_html=True
+                            st.download_button(
+                                label=f"Download Calendar for {selected_employee}",
+                                data=calendar_data,
+                                file_name=file_name,
+                                mime="text/calendar"
                             )
                             
                             st.success(f"Calendar for {selected_employee} generated successfully!")